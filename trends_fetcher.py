@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 import os
 import json
-import time
+import re
 import requests
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
 
@@ -33,11 +33,31 @@ def connect_to_sheet(sheet_name):
         "https://www.googleapis.com/auth/drive",
     ]
     creds_dict = json.loads(os.environ["GOOGLE_SA_JSON"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
     client = gspread.authorize(creds)
     return client.open(sheet_name).get_worksheet(0)
 
 
+EXPLORE_URL = "https://trends.google.com/trends/explore?q={}&date=now%201-d&geo=KR&hl=en"
+
+DATE_ICON_LABELS = frozenset({"trending_up", "timelapse"})
+
+ABSOLUTE_DATE = re.compile(r"\b(?:20\d\d|\d{1,2}:\d{2}\s*(?:AM|PM))\b")
+
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+
+BLOCKED_HOSTS = ("doubleclick.net", "google-analytics.com", "googletagmanager.com")
+
+
+def block_heavy_resources(route):
+    host = urlparse(route.request.url).hostname or ""
+    blocked_host = any(host == h or host.endswith("." + h) for h in BLOCKED_HOSTS)
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES or blocked_host:
+        route.abort()
+    else:
+        route.continue_()
+
+
 def dismiss_cookie_banner(page):
     for label in ("Accept all", "I agree", "AGREE"):
         try:
@@ -51,142 +71,264 @@ def dismiss_cookie_banner(page):
             pass
 
 
-def extract_table_rows(page):
+TABLE_ROWS_JS = """
+() => Array.from(document.querySelectorAll("table tbody tr")).map((row, index) => {
+    if (index === 0) return null;
+    const box = row.getBoundingClientRect();
+    if (!box.width || !box.height || getComputedStyle(row).visibility === "hidden") return null;
+    const cells = row.querySelectorAll("td");
+    if (cells.length < 5) return null;
+    return {
+        index,
+        title: cells[1].innerText.split("\\n")[0].trim(),
+        volume: cells[2].innerText,
+        dates: cells[3].innerText,
+        breakdown: Array.from(cells[4].querySelectorAll("span.mUIrbf-vQzf8d, span.Gwdjic"), span => span.innerText),
+    };
+}).filter(Boolean)
+"""
+
+CARD_ROWS_JS = """
+() => Array.from(document.querySelectorAll("div.mZ3RIc")).slice(1).map((card, i) => {
+    const title = card.querySelector("span.mUIrbf-vQzf8d");
+    const volume = card.querySelector("div.search-count-title");
+    const toggle = card.querySelector("div.vdw3Ld");
+    return {
+        index: i + 1,
+        title: title ? title.innerText.trim() : "",
+        volume: volume ? volume.innerText : "",
+        dates: toggle ? toggle.parentElement.innerText : "",
+        breakdown: Array.from(card.querySelectorAll("div.lqv0Cb span.mUIrbf-vQzf8d, div.lqv0Cb span.Gwdjic"), span => span.innerText),
+    };
+}).filter(item => item.title)
+"""
+
+
+DATE_TEXTS_JS = """
+({rows, cell, indexes}) => {
+    const all = document.querySelectorAll(rows);
+    return indexes.map(index => {
+        const row = all[index];
+        const scope = row && (cell === null ? row : row.querySelectorAll("td")[cell]);
+        const toggle = scope && scope.querySelector("div.vdw3Ld");
+        if (!toggle) return [index, null];
+        return [index, (cell === null ? toggle.parentElement : scope).innerText];
+    });
+}
+"""
+
+DATES_CHANGED_JS = f"""
+({{rows, cell, indexes, before, changed}}) => ({DATE_TEXTS_JS.strip()})({{rows, cell, indexes}})
+    .every(([index, text]) => text !== null && (text !== before[index]) === changed)
+"""
+
+
+def page_changed_js(rows_js):
+    return f"""
+prev => {{
+    const rows = ({rows_js.strip()})();
+    return rows.length > 0 && rows[0].title !== prev;
+}}
+"""
+
+
+def split_date_lines(text):
+    return [line for line in text.split("\n") if line and line.lower() not in DATE_ICON_LABELS]
+
+
+def read_date_texts(page, rows_selector, cell, indexes):
+    arg = {"rows": rows_selector, "cell": cell, "indexes": indexes}
+    return {index: text for index, text in page.evaluate(DATE_TEXTS_JS, arg) if text is not None}
+
+
+def wait_for_date_texts(page, rows_selector, cell, before, changed):
+    arg = {
+        "rows": rows_selector,
+        "cell": cell,
+        "indexes": list(before),
+        "before": {str(index): text for index, text in before.items()},
+        "changed": changed,
+    }
     try:
-        page.wait_for_selector("table tbody tr", state="attached", timeout=5000)
+        page.wait_for_function(DATES_CHANGED_JS, arg=arg, timeout=1000)
+        return True
     except PlaywrightTimeoutError:
-        return []
+        return False
 
-    rows = page.locator("table tbody tr")
-    total = rows.count()
-    print(f"[Table] Found {total} rows")
 
-    extracted = []
-    for i in range(1, total):
-        row = rows.nth(i)
-        if not row.is_visible():
-            continue
+def date_toggle(page, rows_selector, cell, index):
+    row = page.locator(rows_selector).nth(index)
+    scope = row if cell is None else row.locator("td").nth(cell)
+    return scope.locator("div.vdw3Ld").first
 
-        cells = row.locator("td")
-        if cells.count() < 5:
+
+def read_toggled_dates(page, rows_selector, cell, items):
+    if not items:
+        return {}
+
+    before = read_date_texts(page, rows_selector, cell, [item["index"] for item in items])
+    toggled = {}
+    page_wide_checked = False
+    for index, text in before.items():
+        toggle = date_toggle(page, rows_selector, cell, index)
+        try:
+            toggle.click(timeout=5000)
+        except PlaywrightTimeoutError:
             continue
 
-        title = cells.nth(1).inner_text().split("\n")[0].strip()
-        volume = cells.nth(2).inner_text().split("\n")[0].strip()
+        flipped = wait_for_date_texts(page, rows_selector, cell, {index: text}, True)
+        if flipped and not page_wide_checked:
+            page_wide_checked = True
+            others = {i: t for i, t in before.items() if i != index}
+            current = read_date_texts(page, rows_selector, cell, list(others))
+            if any(current.get(i) != t for i, t in others.items()):
+                wait_for_date_texts(page, rows_selector, cell, others, True)
+                current = read_date_texts(page, rows_selector, cell, list(before))
+                toggled = {i: t for i, t in current.items() if t != before[i]}
+                try:
+                    toggle.click(timeout=5000)
+                except Exception:
+                    pass
+                wait_for_date_texts(page, rows_selector, cell, before, False)
+                break
+
+        if flipped:
+            toggled.update(read_date_texts(page, rows_selector, cell, [index]))
+        try:
+            toggle.click(timeout=5000)
+        except Exception:
+            pass
+        wait_for_date_texts(page, rows_selector, cell, {index: text}, False)
+
+    if len(toggled) < len(items):
+        print(f"[Dates] Toggle gave no date for {len(items) - len(toggled)} of {len(items)} rows, using started")
+    return toggled
 
-        raw = cells.nth(3).inner_text().split("\n")
-        parts = [line for line in raw if line and line.lower() not in ("trending_up", "timelapse")]
+
+def read_dates(page, rows_selector, cell, items):
+    dates = []
+    for item in items:
+        parts = split_date_lines(item["dates"])
         started = parts[0].strip() if parts else ""
         ended = parts[1].strip() if len(parts) > 1 else ""
+        dates.append((started, ended))
 
-        toggle = cells.nth(3).locator("div.vdw3Ld")
-        target_publish = ended
-        try:
-            toggle.click()
-            time.sleep(0.2)
-            raw2 = cells.nth(3).inner_text().split("\n")
-            p2 = [line for line in raw2 if line and line.lower() not in ("trending_up", "timelapse")]
-            if p2:
-                target_publish = p2[0].strip()
-        finally:
-            try:
-                toggle.click()
-                time.sleep(0.1)
-            except Exception:
-                pass
+    pending = [item for item, (started, _) in zip(items, dates) if not ABSOLUTE_DATE.search(started)]
+    toggled = read_toggled_dates(page, rows_selector, cell, pending)
 
-        spans = cells.nth(4).locator("span.mUIrbf-vQzf8d, span.Gwdjic")
-        breakdown = ", ".join(span.strip() for span in spans.all_inner_texts() if span.strip())
+    resolved = []
+    for item, (started, ended) in zip(items, dates):
+        if ABSOLUTE_DATE.search(started):
+            target_publish = started
+        else:
+            p2 = split_date_lines(toggled.get(item["index"]) or item["dates"])
+            target_publish = p2[0].strip() if p2 else ended
+        resolved.append((started, ended, target_publish))
+    return resolved
 
-        query = quote(title)
-        explore_url = f"https://trends.google.com/trends/explore?q={query}&date=now%201-d&geo=KR&hl=en"
 
-        extracted.append([title, volume, started, ended, explore_url, target_publish, breakdown])
+def build_row(title, volume, started, ended, target_publish, spans):
+    breakdown = ", ".join(span.strip() for span in spans if span.strip())
 
-    return extracted
+    explore_url = EXPLORE_URL.format(quote(title, safe=""))
 
+    return [title, volume, started, ended, explore_url, target_publish, breakdown]
 
-def extract_card_rows(page):
+
+def extract_table_rows(page):
     try:
-        page.wait_for_selector("div.mZ3RIc", timeout=5000)
+        page.wait_for_selector("table tbody tr", state="attached", timeout=5000)
     except PlaywrightTimeoutError:
         return []
 
-    cards = page.locator("div.mZ3RIc")
-    total = cards.count()
-    print(f"[Card] Found {total} cards")
+    data = page.evaluate(TABLE_ROWS_JS)
+    print(f"[Table] Found {len(data)} rows")
 
     extracted = []
-    for i in range(1, total):
-        card = cards.nth(i)
-        title = card.locator("span.mUIrbf-vQzf8d").all_inner_texts()[0].strip()
-        volume = card.locator("div.search-count-title").inner_text().strip()
+    for item, (started, ended, target_publish) in zip(data, read_dates(page, "table tbody tr", 3, data)):
+        volume = item["volume"].split("\n")[0].strip()
+        extracted.append(build_row(item["title"], volume, started, ended, target_publish, item["breakdown"]))
 
-        raw = card.locator("div.vdw3Ld").locator("xpath=..").inner_text().split("\n")
-        parts = [line for line in raw if line and line.lower() not in ("trending_up", "timelapse")]
-        started = parts[0].strip() if parts else ""
-        ended = parts[1].strip() if len(parts) > 1 else ""
+    return extracted
 
-        toggle = card.locator("div.vdw3Ld")
-        target_publish = ended
-        try:
-            toggle.click()
-            time.sleep(0.2)
-            raw2 = card.locator("div.vdw3Ld").locator("xpath=..").inner_text().split("\n")
-            p2 = [line for line in raw2 if line and line.lower() not in ("trending_up", "timelapse")]
-            if p2:
-                target_publish = p2[0].strip()
-        finally:
-            try:
-                toggle.click()
-                time.sleep(0.1)
-            except Exception:
-                pass
 
-        spans = card.locator("div.lqv0Cb span.mUIrbf-vQzf8d, div.lqv0Cb span.Gwdjic")
-        breakdown = ", ".join(span.strip() for span in spans.all_inner_texts() if span.strip())
+def extract_card_rows(page):
+    try:
+        page.wait_for_selector("div.mZ3RIc", timeout=5000)
+    except PlaywrightTimeoutError:
+        return []
 
-        query = quote(title)
-        explore_url = f"https://trends.google.com/trends/explore?q={query}&date=now%201-d&geo=KR&hl=en"
+    data = page.evaluate(CARD_ROWS_JS)
+    print(f"[Card] Found {len(data)} cards")
 
-        extracted.append([title, volume, started, ended, explore_url, target_publish, breakdown])
+    extracted = []
+    for item, (started, ended, target_publish) in zip(data, read_dates(page, "div.mZ3RIc", None, data)):
+        volume = item["volume"].strip()
+        extracted.append(build_row(item["title"], volume, started, ended, target_publish, item["breakdown"]))
 
     return extracted
 
 
+def detect_and_extract(page):
+    if page.locator("table tbody tr").count():
+        batch = extract_table_rows(page)
+        if batch:
+            return batch, extract_table_rows
+
+    print("No table rows found, using card layout instead")
+    batch = extract_card_rows(page)
+    return batch, extract_card_rows if batch else None
+
+
 def scrape_all_pages():
     all_rows = []
     with sync_playwright() as p:
         browser = p.chromium.launch(
             headless=True,
-            args=["--no-sandbox", "--disable-setuid-sandbox"]
+            args=["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage", "--disable-gpu"]
         )
-        page = browser.new_page()
-        page.goto("https://trends.google.com/trending?geo=KR&category=17&hl=en", timeout=60000)
-        page.wait_for_load_state("networkidle")
-        print("Initial page loaded")
+        context = browser.new_context()
+        context.route("**/*", block_heavy_resources)
+        page = context.new_page()
+        page.goto("https://trends.google.com/trending?geo=KR&category=17&hl=en", wait_until="domcontentloaded", timeout=60000)
+        try:
+            page.wait_for_selector("table tbody tr, div.mZ3RIc", state="attached", timeout=30000)
+        except PlaywrightTimeoutError:
+            print("No trend rows rendered within 30s of loading the page")
+        else:
+            print("Initial page loaded")
 
         dismiss_cookie_banner(page)
 
+        extractor = None
         page_number = 1
         while True:
             print(f"Scraping page {page_number}")
-            batch = extract_table_rows(page)
-            if not batch:
-                print("No table rows found, using card layout instead")
-                batch = extract_card_rows(page)
+            if extractor:
+                batch = extractor(page)
+            else:
+                batch, extractor = detect_and_extract(page)
 
             print(f"Collected {len(batch)} rows")
             all_rows.extend(batch)
 
+            if not batch:
+                print("No rows found to track pagination, stopping")
+                break
+
             next_btn = page.get_by_role("button", name="Go to next page")
             if not next_btn.count() or next_btn.first.is_disabled():
                 print("No more pages available")
                 break
 
+            rows_js = TABLE_ROWS_JS if extractor is extract_table_rows else CARD_ROWS_JS
             next_btn.first.scroll_into_view_if_needed()
             next_btn.first.click()
-            time.sleep(3)
+            try:
+                page.wait_for_function(page_changed_js(rows_js), arg=batch[0][0], timeout=10000)
+            except PlaywrightTimeoutError:
+                print("Next page did not load, stopping")
+                break
             page_number += 1
 
         browser.close()
@@ -200,8 +342,12 @@ def main():
     sheet = connect_to_sheet("Trends")
     rows = scrape_all_pages()
 
-    sheet.clear()
-    sheet.append_rows(rows, value_input_option="RAW")
+    if not rows:
+        print("No trends scraped, leaving Google Sheet unchanged")
+        return
+
+    sheet.update(values=rows, range_name="A1", value_input_option="RAW")
+    sheet.batch_clear([f"A{len(rows) + 1}:G"])
     print(f"{len(rows)} total trends saved to Google Sheet")
 
 